@@ -106,7 +106,11 @@ const NetworkManager = (function () {
                     }
                 } else if (event.data instanceof ArrayBuffer) {
                     const msg = decodeDrawingMessage(event.data);
-                    if (msg.type === 'draw') {
+                    if (msg.type === 'ping') {
+                        ws.send(encodePingFrame(11, msg.timestamp));
+                    } else if (msg.type === 'pong' || msg.type === 'heartbeat') {
+                        lastHeartbeat = Date.now();
+                    } else if (msg.type === 'draw') {
                         DrawingManager.processRemoteDrawing(msg);
                         if (msg.version && msg.version > DrawingManager.getStateVersion()) {
                             DrawingManager.updateStateVersion(msg.version);
@@ -129,6 +133,14 @@ const NetworkManager = (function () {
                             // Request full state refresh after undo
                             requestCurrentState();
                         }
+                    } else if (msg.type === 'batch') {
+                        msg.drawings.forEach(drawing => DrawingManager.processRemoteDrawing(drawing));
+                        if (msg.version > DrawingManager.getStateVersion()) {
+                            DrawingManager.updateStateVersion(msg.version);
+                        }
+                    } else if (msg.type === 'state') {
+                        DrawingManager.updateDrawingState(msg.state, msg.version);
+                        console.log(`Received state from server with version ${msg.version}, state size: ${msg.state.length}`);
                     }
                 }
             };
@@ -137,6 +149,50 @@ const NetworkManager = (function () {
         attemptConnection(localWsUrl);
     }
 
+    // Decode one draw frame starting at offset; returns the drawing and the offset after it.
+    // Type 1 frames carry float32 points, type 6 frames uint16 points scaled to 0..65535.
+    function decodeDrawFrame(view, offset) {
+        const quantized = view.getUint8(offset) === 6;
+        offset += 1; // Frame type
+        const version = view.getUint32(offset, false);
+        offset += 4;
+        const colorInt = view.getUint32(offset, false);
+        offset += 4;
+        const color = '#' + colorInt.toString(16).padStart(6, '0');
+        const width = view.getFloat32(offset, false);
+        offset += 4;
+        const numPoints = view.getUint32(offset, false);
+        offset += 4;
+        const points = [];
+        if (quantized) {
+            for (let i = 0; i < numPoints; i++) {
+                const x = view.getUint16(offset, false) / 65535;
+                offset += 2;
+                const y = view.getUint16(offset, false) / 65535;
+                offset += 2;
+                points.push({ x, y });
+            }
+        } else {
+            for (let i = 0; i < numPoints; i++) {
+                const x = view.getFloat32(offset, false);
+                offset += 4;
+                const y = view.getFloat32(offset, false);
+                offset += 4;
+                points.push({ x, y });
+            }
+        }
+        return { drawing: { type: 'draw', version, color, width, points }, offset };
+    }
+
+    // Binary ping (type 10), pong (type 11) and heartbeat (type 12): type byte and a float64 timestamp
+    function encodePingFrame(type, timestamp) {
+        const buffer = new ArrayBuffer(9);
+        const view = new DataView(buffer);
+        view.setUint8(0, type);
+        view.setFloat64(1, timestamp, false);
+        return buffer;
+    }
+
     function decodeDrawingMessage(buffer) {
         const view = new DataView(buffer);
         let offset = 0;
@@ -145,25 +201,26 @@ const NetworkManager = (function () {
 
         console.log("Received binary message type:", msgType);
 
-        if (msgType === 1) {
+        if (msgType === 1 || msgType === 6) {
+            return decodeDrawFrame(view, 0).drawing;
+        } else if (msgType === 4 || msgType === 5) { // Batch or full state: version, stroke count, then draw frames
             const version = view.getUint32(offset, false);
             offset += 4;
-            const colorInt = view.getUint32(offset, false);
-            offset += 4;
-            const color = '#' + colorInt.toString(16).padStart(6, '0');
-            const width = view.getFloat32(offset, false);
+            const count = view.getUint32(offset, false);
             offset += 4;
-            const numPoints = view.getUint32(offset, false);
-            offset += 4;
-            const points = [];
-            for (let i = 0; i < numPoints; i++) {
-                const x = view.getFloat32(offset, false);
-                offset += 4;
-                const y = view.getFloat32(offset, false);
-                offset += 4;
-                points.push({ x, y });
+            const state = [];
+            for (let i = 0; i < count; i++) {
+                const decoded = decodeDrawFrame(view, offset);
+                state.push(decoded.drawing);
+                offset = decoded.offset;
+            }
+            if (msgType === 4) {
+                return { type: 'batch', version, drawings: state };
             }
-            return { type: 'draw', version, color, width, points };
+            return { type: 'state', version, state };
+        } else if (msgType === 10 || msgType === 11 || msgType === 12) {
+            const timestamp = view.getFloat64(offset, false);
+            return { type: { 10: 'ping', 11: 'pong', 12: 'heartbeat' }[msgType], timestamp };
         } else if (msgType === 2) {
             const version = view.getUint32(offset, false);
             return { type: 'clear', version };
@@ -236,10 +293,7 @@ const NetworkManager = (function () {
 
         heartbeatInterval = setInterval(() => {
             if (ws && ws.readyState === WebSocket.OPEN) {
-                ws.send(JSON.stringify({
-                    type: 'ping',
-                    timestamp: Date.now()
-                }));
+                ws.send(encodePingFrame(10, Date.now()));
 
                 if (Date.now() - lastHeartbeat > Config.network.HEARTBEAT_TIMEOUT) {
                     updateStatus("Connection lost - Reconnecting...");
@@ -313,25 +367,30 @@ const NetworkManager = (function () {
         }
     }
 
+    function quantizeCoord(value) {
+        return Math.round(Math.max(0, Math.min(1, value)) * 65535);
+    }
+
     function sendDrawing(drawData) {
         if (ws && ws.readyState === WebSocket.OPEN) {
             try {
                 // Mark activity occurred
                 markActivity();
                 
+                // Type 6: points quantized to uint16, coordinates are normalized to 0..1
                 const numPoints = drawData.points.length;
-                const buffer = new ArrayBuffer(17 + numPoints * 8);
+                const buffer = new ArrayBuffer(17 + numPoints * 4);
                 const view = new DataView(buffer);
                 let offset = 0;
-                view.setUint8(offset, 1); offset += 1;
+                view.setUint8(offset, 6); offset += 1;
                 view.setUint32(offset, drawData.version || 0, false); offset += 4;
                 const colorInt = parseInt(drawData.color.slice(1), 16);
                 view.setUint32(offset, colorInt, false); offset += 4;
                 view.setFloat32(offset, drawData.width, false); offset += 4;
                 view.setUint32(offset, numPoints, false); offset += 4;
                 for (let i = 0; i < numPoints; i++) {
-                    view.setFloat32(offset, drawData.points[i].x, false); offset += 4;
-                    view.setFloat32(offset, drawData.points[i].y, false); offset += 4;
+                    view.setUint16(offset, quantizeCoord(drawData.points[i].x), false); offset += 2;
+                    view.setUint16(offset, quantizeCoord(drawData.points[i].y), false); offset += 2;
                 }
                 ws.send(buffer);
             } catch (error) {
@@ -1,11 +1,16 @@
-import json
 import logging
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from typing import Dict, Set, List, Optional, Any, Tuple
+from typing import Dict, Set, List, Optional, Any, Sequence, Tuple
 import asyncio
+import collections
+import functools
+import heapq
+import itertools
 import time
 import struct
 import math
+import os
+import orjson
 
 START_TIME = time.time()
 
@@ -13,19 +18,26 @@ START_TIME = time.time()
 def setup_logger(name: str) -> logging.Logger:
     """Configure and return a logger with the given name."""
     logger = logging.getLogger(name)
+    # INFO by default: per-frame debug records are only wanted when troubleshooting, e.g.
+    # with LOG_LEVEL=DEBUG
+    level = os.environ.get("LOG_LEVEL", "INFO").upper()
 
     # Configure basic logging
     logging.basicConfig(
-        level=logging.DEBUG,
+        level=level,
         format='%(asctime)s - %(levelname)s - [%(name)s] - %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
     )
 
-    # Add StreamHandler to ensure logging outputs to the terminal
-    stream_handler = logging.StreamHandler()
-    stream_handler.setLevel(logging.DEBUG)
-    stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - [%(name)s] - %(message)s'))
-    logger.addHandler(stream_handler)
+    # Add StreamHandler to ensure logging outputs to the terminal. Only once, and without also
+    # propagating to the root handler set up above, so each record is formatted and written once.
+    if not logger.handlers:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setLevel(logging.DEBUG)
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - [%(name)s] - %(message)s'))
+        logger.addHandler(stream_handler)
+    logger.propagate = False
+    logger.setLevel(level)
 
     return logger
 
@@ -34,77 +46,209 @@ logger = setup_logger('WebSocket-Server')
 
 app = FastAPI()
 
+def encode_message(message: dict) -> str:
+    """Serialize a message once with orjson so it can be sent to many clients as a text frame."""
+    return orjson.dumps(message).decode()
+
+@functools.lru_cache(maxsize=256)
+def points_struct(num_points: int, quantized: bool = False) -> struct.Struct:
+    """Return a compiled Struct for num_points big-endian (x, y) pairs.
+
+    Pairs are float32, or uint16 scaled to 0..65535 for quantized (type 6) draw frames.
+    """
+    return struct.Struct(f'!{2 * num_points}{"H" if quantized else "f"}')
+
+# Precompiled binary frame layouts, all big-endian
+MESSAGE_HEADER = struct.Struct('!B I')  # type, state version; also the whole clear/undo frame
+DRAW_FIELDS = struct.Struct('!I f I')  # color, width, point count; follows MESSAGE_HEADER
+DRAW_HEADER = struct.Struct('!B I I f I')  # MESSAGE_HEADER and DRAW_FIELDS together
+STATE_HEADER = struct.Struct('!B I I')  # type, state version, frame count; batch and full state
+VERSION_FIELD = struct.Struct('!I')  # state version, at offset 1 of every frame
+POINT = struct.Struct('!f f')
+QUANTIZED_POINT = struct.Struct('!H H')  # Type 6 draw frames: coordinates scaled to 0..65535
+# Binary ping (type 10), pong (type 11) and heartbeat (type 12) frames: type and a float64 timestamp
+PING_FRAME = struct.Struct('!B d')
+
+# Client types accepted on /ws/{client_type}
+CLIENT_TYPES = frozenset({'draw', 'display'})
+
+# Largest WebSocket message uvicorn accepts from a client (ws_max_size, --ws-max-size in
+# startup.sh). Bigger ones close the connection before they are buffered. 1 MiB fits a JSON
+# draw message of the largest accepted stroke.
+MAX_MESSAGE_SIZE = 1024 * 1024
+
+def stroke_point_count(frame: bytes) -> int:
+    """Return the number of points in a binary draw frame."""
+    return (len(frame) - DRAW_HEADER.size) // (QUANTIZED_POINT.size if frame[0] == 6 else POINT.size)
+
+def pack_draw_batch(frames: List[bytes], version: int) -> bytes:
+    """Combine draw frames into one batch frame: type 4, state version and frame count,
+    followed by the frames back to back. A single frame is returned as is."""
+    if len(frames) == 1:
+        return frames[0]
+    return STATE_HEADER.pack(4, version, len(frames)) + b''.join(frames)
+
+def decode_draw_frame(data: memoryview, msg_type: int, version: int) -> dict:
+    # Type 6 carries uint16 instead of float32 points
+    try:
+        quantized = msg_type == 6
+        color_int, width, num_points = DRAW_FIELDS.unpack_from(data, MESSAGE_HEADER.size)
+        # Only the header is read. The frame is relayed as is, so the points stay packed.
+        if len(data) < DRAW_HEADER.size + points_struct(num_points, quantized).size:
+            raise ValueError(f"{len(data)} bytes is too short for {num_points} points")
+        # Color stays a 0xRRGGBB int; only JSON draw messages use "#rrggbb" strings
+        return {"type": "draw", "version": version, "color": color_int, "width": width,
+                "num_points": num_points, "quantized": quantized}
+    except Exception as e:
+        logger.error(f"Error decoding draw message: {e}")
+        return {}
+
+def decode_clear_frame(data: memoryview, msg_type: int, version: int) -> dict:
+    return {"type": "clear", "version": version}
+
+def decode_undo_frame(data: memoryview, msg_type: int, version: int) -> dict:
+    logger.info("Received undo message with version %s", version)
+    return {"type": "undo", "version": version}
+
+def decode_ping_frame(data: memoryview, msg_type: int, version: int) -> dict:
+    if len(data) != PING_FRAME.size:
+        return {}
+    _, timestamp = PING_FRAME.unpack(data)
+    return {"type": "ping" if msg_type == 10 else "pong", "timestamp": timestamp}
+
+# Binary message type -> decoder
+BINARY_DECODERS = {
+    1: decode_draw_frame,
+    2: decode_clear_frame,
+    3: decode_undo_frame,
+    6: decode_draw_frame,
+    10: decode_ping_frame,
+    11: decode_ping_frame,
+}
+
 def decode_draw_message(binary_data: bytes) -> dict:
     # Decode binary drawing message:
-    header_size = struct.calcsize('!B I')  # type, version
+    header_size = MESSAGE_HEADER.size  # type, version
     if len(binary_data) < header_size:
         logger.error(f"Binary message too short: {len(binary_data)} bytes")
         return {}
 
-    msg_type, version = struct.unpack('!B I', binary_data[:header_size])
+    data = memoryview(binary_data)  # Unpack in place without slicing copies
+    msg_type, version = MESSAGE_HEADER.unpack_from(data, 0)
 
-    logger.debug(f"Decoded binary message: type={msg_type}, version={version}")
+    # Runs for every frame: let logging format lazily, only if DEBUG is enabled
+    logger.debug("Decoded binary message: type=%s, version=%s", msg_type, version)
 
-    if msg_type == 1:
-        # Continue with draw message decoding
-        try:
-            color_width_size = struct.calcsize('!I f I')
-            color_int, width, num_points = struct.unpack('!I f I', binary_data[header_size:header_size+color_width_size])
-            points = []
-            point_size = struct.calcsize('!f f')
-            offset = header_size + color_width_size
-            for _ in range(num_points):
-                x, y = struct.unpack('!f f', binary_data[offset:offset+point_size])
-                points.append({'x': x, 'y': y})
-                offset += point_size
-            color = f"#{color_int:06x}"
-            return {"type": "draw", "version": version, "color": color, "width": width, "points": points}
-        except Exception as e:
-            logger.error(f"Error decoding draw message: {e}")
-            return {}
-    elif msg_type == 2:
-        return {"type": "clear", "version": version}
-    elif msg_type == 3:
-        logger.info(f"Received undo message with version {version}")
-        return {"type": "undo", "version": version}
-    else:
+    decoder = BINARY_DECODERS.get(msg_type)
+    if decoder is None:
         logger.warning(f"Unknown binary message type: {msg_type}")
-    return {}
+        return {}
+    return decoder(data, msg_type, version)
+
+class ClientSlot:
+    """Per-client state, stored in ConnectionManager's slot list under a dense integer id."""
+
+    __slots__ = ('cid', 'websocket', 'client_type', 'version', 'epoch', 'last_ping', 'ip', 'queue', 'writer')
+
+    def __init__(self, cid: int, websocket: WebSocket, client_type: str, queue: asyncio.Queue) -> None:
+        self.cid = cid
+        self.websocket = websocket
+        self.client_type = client_type
+        self.version: int = 0
+        self.epoch: int = -1  # Snapshot epoch of the last full state sent to this client
+        self.last_ping: float = 0.0
+        self.ip: str = websocket.client.host
+        self.queue = queue
+        self.writer: Optional[asyncio.Task] = None
+
+    def describe(self) -> str:
+        return f"Type: {self.client_type} | Client Address: {self.websocket.client.host}:{self.websocket.client.port}"
 
 class ConnectionManager:
     """Manages WebSocket connections, client state tracking and broadcasting."""
 
-    def __init__(self, max_points_per_drawing: int = 100, max_drawings: int = 1000) -> None:
+    def __init__(self, max_points_per_drawing: int = 100, max_drawings: int = 1000, max_queue_size: int = 256,
+                 max_event_log: int = 1024, draw_batch_interval: float = 0.015, max_total_points: int = 500_000,
+                 max_stroke_points: int = 10_000) -> None:
         """Initialize the connection manager with empty collections for tracking state.
         
         Args:
             max_points_per_drawing (int): Maximum number of points to keep per drawing after compression.
                 Higher values preserve more detail but use more memory/bandwidth. Default: 100
-            max_drawings (int): Maximum number of drawings to keep in memory. When exceeded,
-                older drawings will be pruned while preserving the most recent ones. Default: 1000
+            max_drawings (int): Maximum number of drawings to keep in memory. When exceeded, the
+                oldest half is pruned and every client is resent the full state. Default: 1000
+            max_queue_size (int): Maximum number of outgoing messages buffered per client. A client
+                whose queue fills up is too slow to keep up and gets disconnected. Default: 256
+            max_event_log (int): Number of recent binary draw/clear/undo frames kept for delta syncs.
+                Clients lagging further behind than this receive the full state instead. Default: 1024
+            draw_batch_interval (float): Seconds to coalesce incoming draw frames before sending them
+                to clients as a single batch frame. Default: 0.015
+            max_total_points (int): Maximum number of points across all stored drawings. When exceeded,
+                the oldest drawings are pruned until half the budget is left. Default: 500000
+            max_stroke_points (int): Largest number of points accepted in a single drawing. Bigger
+                draw messages are dropped. Default: 10000
         """
-        # Client connections organized by type
-        self.active_connections: Dict[str, Set[WebSocket]] = {
-            'draw': set(),
-            'display': set()
+        # Connected clients indexed by client id; ids of disconnected clients are reused.
+        # Disconnecting only blanks a slot, so the list can be walked while clients drop out.
+        self._slots: List[Optional[ClientSlot]] = []
+        self._free: List[int] = []
+        self.connection_counts: Dict[str, int] = {
+            'draw': 0,
+            'display': 0
         }
 
         # Drawing state tracking with memory management
-        self.drawing_state: List[dict] = []
+        # Binary draw frames keyed by a monotonically assigned stroke id; dicts keep insertion
+        # order. Only the clients need the decoded points, so strokes stay in wire format.
+        self.drawing_state: Dict[int, bytes] = {}
+        self.drawing_owners: Dict[int, str] = {}  # Stroke id -> client IP
+        self.total_points: int = 0  # Points across all stored strokes, kept up to date for /health
+        self._next_id: int = 0
         self.max_drawings = max_drawings
+        self.max_total_points = max_total_points
+        self.max_stroke_points = max_stroke_points
         self.last_update_time: float = time.time()
         self.state_version: int = 0
+        # Bumped whenever old strokes are pruned; clients on an older epoch need the full state
+        self.snapshot_epoch: int = 0
+        # (state_version, snapshot_epoch) every client was last brought up to by a sync pass
+        self._synced_state: Tuple[int, int] = (0, 0)
+
+        # Binary full-state frame, rebuilt only when state_version moves on
+        self._state_snapshot: Optional[bytes] = None
+        self._snapshot_version: int = -1
+
+        # Recent (state_version, binary frame) pairs for delta syncs of lagging clients
+        self.event_log: collections.deque = collections.deque(maxlen=max_event_log)
+        # Catch-up payloads by client version, valid for _catch_up_version only
+        self._catch_up_cache: Dict[int, Optional[List[bytes]]] = {}
+        self._catch_up_version: int = -1
 
         # IP-based drawing tracking with memory management
-        self.drawings_by_ip: Dict[str, List[dict]] = {}
+        self.drawings_by_ip: Dict[str, collections.deque] = {}  # Stroke ids, oldest first
         self.ip_drawing_counts: Dict[str, int] = {}
 
-        # Client state tracking
-        self.client_versions: Dict[WebSocket, int] = {}
-        self.last_ping_times: Dict[WebSocket, float] = {}
+        # Min-heap of (last_ping_time, seq, slot) for finding idle clients.
+        # Entries are pushed lazily on activity; superseded ones are skipped when popped.
+        self._ping_heap: List[Tuple[float, int, ClientSlot]] = []
+        self._ping_seq = itertools.count()
 
-        # Background task reference
-        self.heartbeat_task: Optional[asyncio.Task] = None
+        # Each client's outgoing queue is drained by a dedicated writer task
+        self.max_queue_size = max_queue_size
+
+        # Draw frames waiting to be sent as one batch, as (frame, sender) pairs
+        self._pending_draws: List[Tuple[bytes, Optional[ClientSlot]]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        # Clients sent the first n pending draws by a catch-up or full state send -> n
+        self._skip_flush: Dict[ClientSlot, int] = {}
+        self.draw_batch_interval = draw_batch_interval
+
+        # Latest system usage readings, refreshed in the background for /health
+        self.cpu_percent: float = 0.0
+        self.memory_percent: float = 0.0
+
+        # Event loop the server runs on, set at startup. Activity times use its monotonic clock.
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
 
         logger.info("ConnectionManager initialized")
 
@@ -113,128 +257,356 @@ class ConnectionManager:
         logger.info(f"Drawing compression configured to keep {max_points_per_drawing} points per drawing")
 
 
-    async def connect(self, websocket: WebSocket, client_type: str):
+    async def connect(self, websocket: WebSocket, client_type: str) -> ClientSlot:
         client_info = f"Client connecting - Type: {client_type} | Client Address: {websocket.client.host}:{websocket.client.port}"
         logger.info(client_info)
 
         await websocket.accept()
-        self.active_connections[client_type].add(websocket)
-        self.client_versions[websocket] = 0  # New client starts at version 0
-        self.last_ping_times[websocket] = asyncio.get_event_loop().time()
+        cid = self._free.pop() if self._free else len(self._slots)
+        slot = ClientSlot(cid, websocket, client_type, asyncio.Queue(maxsize=self.max_queue_size))
+        if cid == len(self._slots):
+            self._slots.append(slot)
+        else:
+            self._slots[cid] = slot
+        self.connection_counts[client_type] += 1
+        self.record_activity(slot, self.event_loop().time())
+        slot.writer = asyncio.create_task(self._writer(slot))
 
         logger.info(f"Client successfully connected - {client_info}")
 
         # Send current state to new client with version information
-        state_size = len(self.drawing_state)
-        await websocket.send_json({
-            "type": "state",
-            "state": self.drawing_state,
-            "version": self.state_version
-        })
-
-    def disconnect(self, websocket: WebSocket, client_type: str):
-        logger.info(f"Client disconnecting - Type: {client_type} | Client Address: {websocket.client.host}:{websocket.client.port}")
-        self.active_connections[client_type].remove(websocket)
-        if websocket in self.client_versions:
-            del self.client_versions[websocket]
-        if websocket in self.last_ping_times:
-            del self.last_ping_times[websocket]
-
-
-    def triangle_area(self, p1: Dict[str, float], p2: Dict[str, float], p3: Dict[str, float]) -> float:
+        self.send_state(slot)
+        return slot
+
+    def get_missing_frames(self, client_version: int) -> Optional[List[bytes]]:
+        """Return the logged binary frames a client at client_version has missed.
+
+        Returns None when the gap reaches back past the oldest logged event or is too large to
+        queue in one go, in which case the client needs the full state instead.
+        """
+        if not self.event_log or client_version < self.event_log[0][0] - 1:
+            return None
+        if self.state_version - client_version > self.max_queue_size // 2:
+            return None
+        missing = []
+        for version, frame in reversed(self.event_log):
+            if version <= client_version:
+                break
+            missing.append(frame)
+        missing.reverse()
+        return missing
+
+    def get_catch_up_payloads(self, client_version: int) -> Optional[List[bytes]]:
+        """Return the frames to queue for a client at client_version, or None if it needs the
+        full state.
+
+        Runs of consecutive draws are packed into one batch frame each. The result is cached
+        until the state version changes, so clients at the same version share the same frames.
+        """
+        # Only versions the log can catch up from get a cache entry; client_version can come
+        # straight from a client message
+        if (not isinstance(client_version, int) or not self.event_log
+                or not self.event_log[0][0] - 1 <= client_version < self.state_version):
+            return None
+
+        if self._catch_up_version != self.state_version:
+            self._catch_up_cache.clear()
+            self._catch_up_version = self.state_version
+        if client_version in self._catch_up_cache:
+            return self._catch_up_cache[client_version]
+
+        missing_frames = self.get_missing_frames(client_version)
+        payloads = None
+        if missing_frames is not None:
+            payloads = []
+            for is_draw, run in itertools.groupby(missing_frames, key=lambda frame: frame[0] in (1, 6)):
+                if is_draw:
+                    run = list(run)
+                    payloads.append(pack_draw_batch(run, VERSION_FIELD.unpack_from(run[-1], 1)[0]))
+                else:
+                    payloads.extend(run)
+        self._catch_up_cache[client_version] = payloads
+        return payloads
+
+    def get_state_snapshot(self) -> bytes:
+        """Return the binary full-state frame, rebuilding it only if the state has changed.
+
+        The frame is type 5 with the state version and stroke count, followed by the stored
+        draw frames back to back.
+        """
+        if self._snapshot_version != self.state_version:
+            header = STATE_HEADER.pack(5, self.state_version, len(self.drawing_state))
+            self._state_snapshot = header + b''.join(self.drawing_state.values())
+            self._snapshot_version = self.state_version
+        return self._state_snapshot
+
+    def send_state(self, slot: ClientSlot) -> bool:
+        """Queue the full state for a client, bringing it up to the current version and epoch."""
+        if not self.queue_message(slot, self.get_state_snapshot()):
+            return False
+        if self._pending_draws:
+            self._skip_flush[slot] = len(self._pending_draws)  # These are already in the snapshot
+        slot.version = self.state_version
+        slot.epoch = self.snapshot_epoch
+        return True
+
+    def catch_up_client(self, slot: ClientSlot, client_version: int):
+        """Queue what a client at client_version needs to reach the current state version."""
+        # Deltas can't remove strokes pruned since the client last had the full state
+        if slot.epoch != self.snapshot_epoch:
+            self.send_state(slot)
+            return
+
+        # Replay just the missed events when the log still covers them
+        payloads = self.get_catch_up_payloads(client_version)
+        if payloads is None:  # Too far behind, send full state
+            self.send_state(slot)
+            return
+
+        if all(self.queue_message(slot, payload) for payload in payloads):
+            slot.version = self.state_version
+            if self._pending_draws:
+                self._skip_flush[slot] = len(self._pending_draws)  # These were part of the replay
+
+    def is_connected(self, slot: ClientSlot) -> bool:
+        return self._slots[slot.cid] is slot
+
+    def disconnect(self, slot: ClientSlot):
+        if not self.is_connected(slot):
+            return  # Already cleaned up, e.g. after a failed send
+        logger.info(f"Client disconnecting - {slot.describe()}")
+        self._slots[slot.cid] = None
+        self._free.append(slot.cid)
+        self.connection_counts[slot.client_type] -= 1
+        if slot.writer and slot.writer is not asyncio.current_task():
+            slot.writer.cancel()
+
+    def connected_slots(self):
+        """Iterate over the slots of every connected client.
+
+        Safe to use while disconnecting clients, which only blanks their slots.
+        """
+        return (slot for slot in self._slots if slot is not None)
+
+    def event_loop(self) -> asyncio.AbstractEventLoop:
+        """Return the loop set at startup, or the running loop if the startup hook hasn't run."""
+        return self.loop or asyncio.get_running_loop()
+
+    def record_activity(self, slot: ClientSlot, now: float):
+        """Note that a client was heard from at time now.
+
+        Frames arriving within a second of the last recorded one are ignored. That is plenty
+        for a 30 second idle check, and keeps busy drawing clients from flooding the heap.
+        """
+        if now - slot.last_ping < 1.0:
+            return
+        slot.last_ping = now
+        heapq.heappush(self._ping_heap, (now, next(self._ping_seq), slot))
+
+    def queue_message(self, slot: ClientSlot, payload) -> bool:
+        """Queue an encoded message (str for text frames, bytes for binary) for a client.
+
+        Never waits on the socket. A client whose queue is full is disconnected instead of
+        holding up everyone else. Returns True if the message was queued.
+        """
+        if not self.is_connected(slot):
+            return False
+        try:
+            slot.queue.put_nowait(payload)
+            return True
+        except asyncio.QueueFull:
+            logger.warning(f"Send queue full, dropping slow client: {slot.describe()}")
+            self.disconnect(slot)
+            asyncio.create_task(slot.websocket.close(code=1013))  # Try again later
+            return False
+
+    async def _writer(self, slot: ClientSlot):
+        """Send queued messages to a single client in order."""
+        websocket, queue = slot.websocket, slot.queue
+        try:
+            while True:
+                payload = await queue.get()
+                if isinstance(payload, bytes):
+                    await websocket.send_bytes(payload)
+                else:
+                    await websocket.send_text(payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to send to client: {e}")
+            self.disconnect(slot)
+
+
+    def triangle_area(self, x1: float, y1: float, x2: float, y2: float, x3: float, y3: float) -> float:
         """Calculate the area of a triangle formed by three points."""
-        return 0.5 * abs(p1['x'] * (p2['y'] - p3['y']) + p2['x'] * (p3['y'] - p1['y']) + p3['x'] * (p1['y'] - p2['y']))
+        return 0.5 * abs(x1 * (y2 - y3) + x2 * (y3 - y1) + x3 * (y1 - y2))
 
-    def visvalingam_whyatt(self, points: List[Dict[str, float]], num_to_keep: int) -> List[Dict[str, float]]:
-        """Simplify a list of points using the Visvalingam-Whyatt algorithm."""
+    def visvalingam_whyatt(self, coords: Sequence[float], num_to_keep: int) -> List[float]:
+        """Simplify a flat (x0, y0, x1, y1, ...) point sequence, as found in decoded draw
+        messages, using the Visvalingam-Whyatt algorithm."""
 
-        if len(points) <= num_to_keep:
-            return points
+        n = len(coords) // 2
+        if n <= num_to_keep:
+            return list(coords)
 
-        # Calculate areas for each point (except first and last)
-        areas = [0.0]  # First point has no area
-        for i in range(1, len(points) - 1):
-            areas.append(self.triangle_area(points[i-1], points[i], points[i+1]))
-        areas.append(0.0)  # Last point has no area
+        # Separate x and y lists instead of a dict per point
+        xs = coords[0::2]
+        ys = coords[1::2]
+
+        # Points stay where they are; removed ones are unlinked from a doubly linked list
+        prev = list(range(-1, n - 1))
+        next_ = list(range(1, n + 1))
+        alive = [True] * n
+
+        # Calculate areas for each point (except first and last), smallest on top of a heap.
+        # Ties go to the earliest point, as with a linear scan.
+        areas = [0.0] * n
+        for i in range(1, n - 1):
+            areas[i] = self.triangle_area(xs[i-1], ys[i-1], xs[i], ys[i], xs[i+1], ys[i+1])
+        heap = [(areas[i], i) for i in range(1, n - 1)]
+        heapq.heapify(heap)
 
         # Iteratively remove points with smallest area until we have the desired number
-        while len(points) > num_to_keep:
-            # Find the index of the point with the smallest area (excluding endpoints)
-            min_area_index = min(range(1, len(points) - 1), key=lambda i: areas[i])
+        remaining = n
+        while remaining > num_to_keep:
+            area, i = heapq.heappop(heap)
+            if not alive[i] or area != areas[i]:
+                continue  # Point already removed, or its area changed since this entry
 
             # Remove the point and update areas of neighboring points
-            del points[min_area_index]
-            del areas[min_area_index]
+            alive[i] = False
+            remaining -= 1
+            p, q = prev[i], next_[i]
+            next_[p] = q
+            prev[q] = p
 
             # Update area of the previous point (if it's not the first point)
-            if min_area_index > 1:
-                areas[min_area_index - 1] = self.triangle_area(points[min_area_index - 2], points[min_area_index - 1], points[min_area_index])
+            if p > 0:
+                areas[p] = self.triangle_area(xs[prev[p]], ys[prev[p]], xs[p], ys[p], xs[q], ys[q])
+                heapq.heappush(heap, (areas[p], p))
 
             # Update area of the next point (if it's not the last point)
-            if min_area_index < len(points) - 1:
-                areas[min_area_index] = self.triangle_area(points[min_area_index - 1], points[min_area_index], points[min_area_index + 1])
+            if q < n - 1:
+                areas[q] = self.triangle_area(xs[p], ys[p], xs[q], ys[q], xs[next_[q]], ys[next_[q]])
+                heapq.heappush(heap, (areas[q], q))
+
+        return [v for i in range(n) if alive[i] for v in (xs[i], ys[i])]
 
-        return points
+    def forget_ip(self, client_ip: str):
+        """Drop the tracking entries of an IP that has no strokes left."""
+        self.drawings_by_ip.pop(client_ip, None)
+        self.ip_drawing_counts.pop(client_ip, None)
 
     def manage_drawing_state(self):
         """Manage drawing state to prevent memory overflow"""
-        if len(self.drawing_state) > self.max_drawings:
-            # Keep the most recent drawings
-            excess = len(self.drawing_state) - self.max_drawings
-            removed_drawings = self.drawing_state[:excess]
-            self.drawing_state = self.drawing_state[excess:]
-
-            # Update IP-based tracking for removed drawings
-            for drawing in removed_drawings:
-                client_ip = drawing.get('client_ip')
-                if client_ip and client_ip in self.drawings_by_ip:
-                    if drawing in self.drawings_by_ip[client_ip]:
-                        self.drawings_by_ip[client_ip].remove(drawing)
-                        self.ip_drawing_counts[client_ip] = len(self.drawings_by_ip[client_ip])
-
-            logger.info(f"Pruned {excess} old drawings to maintain memory limits")
-
-    async def broadcast(self, message: dict, exclude: WebSocket = None, client_ip: str = None):
+        over_count = len(self.drawing_state) > self.max_drawings
+        over_points = self.total_points > self.max_total_points
+        if not (over_count or over_points):
+            return
+
+        # Drop the oldest drawings until the exceeded limit is down to half. Pruning in bulk
+        # means clients only need the full state again once in a while, not after every stroke.
+        max_count = self.max_drawings // 2 if over_count else self.max_drawings
+        max_points = self.max_total_points // 2 if over_points else self.max_total_points
+        removed_ids = []
+        count, points = len(self.drawing_state), self.total_points
+        for stroke_id, frame in self.drawing_state.items():
+            if count <= max_count and points <= max_points:
+                break
+            removed_ids.append(stroke_id)
+            count -= 1
+            points -= stroke_point_count(frame)
+
+        # Update IP-based tracking for removed drawings
+        for stroke_id in removed_ids:
+            self.total_points -= stroke_point_count(self.drawing_state.pop(stroke_id))
+            client_ip = self.drawing_owners.pop(stroke_id, None)
+            if client_ip and client_ip in self.drawings_by_ip:
+                # Pruned strokes are the oldest overall, so each one is also the oldest
+                # of its IP and sits at the front of that IP's deque
+                ip_strokes = self.drawings_by_ip[client_ip]
+                if ip_strokes and ip_strokes[0] == stroke_id:
+                    ip_strokes.popleft()
+                    self.ip_drawing_counts[client_ip] = len(ip_strokes)
+                if not ip_strokes:
+                    self.forget_ip(client_ip)
+
+        self.snapshot_epoch += 1
+        logger.info(f"Pruned {len(removed_ids)} old drawings to maintain memory limits")
+
+    async def broadcast(self, message: dict, exclude: ClientSlot = None, client_ip: str = None, raw: bytes = None):
         # For logging
         msg_type = message.get("type", "unknown")
 
+        if msg_type != "draw":
+            self.flush_draws()  # Keep queued draws ahead of whatever comes next
+
         binary_message = None
 
         # Update drawing state for draw events
         if message.get("type") == "draw":
-            # Add client IP to the message if provided
+            if raw is not None:  # Binary draw frame, header decoded by decode_draw_frame
+                num_points = message["num_points"]
+            else:  # JSON draw message with a list of point dicts
+                coords = [v for p in message["points"] for v in (p["x"], p["y"])]
+                num_points = len(coords) // 2
+            if num_points > self.max_stroke_points:
+                logger.warning(f"Dropping drawing with {num_points} points from {client_ip}")
+                return
+
+            stroke_id = self._next_id
+            self._next_id += 1
+            self.last_update_time = time.time()
+            self.state_version += 1  # Increment version on state change
+            # Include version in the outgoing message
+            message["version"] = self.state_version
+            quantized = message.get("quantized", False)
+            body_struct = points_struct(num_points, quantized)
+            frame_size = DRAW_HEADER.size + body_struct.size
+            if raw is not None and len(raw) == frame_size:
+                # Relay the client's own frame, only stamping in the new version. Joining
+                # around a memoryview copies the points once, straight into the new frame.
+                binary_message = b''.join((raw[:1], VERSION_FIELD.pack(self.state_version), memoryview(raw)[5:]))
+            else:
+                if raw is not None:  # Trailing bytes after the points: repack just the points
+                    coords = body_struct.unpack_from(raw, DRAW_HEADER.size)
+                # Pack drawing message as binary:
+                color = message["color"]
+                if isinstance(color, str):  # JSON draw message
+                    color = int(color.lstrip('#'), 16)
+                header = DRAW_HEADER.pack(6 if quantized else 1, self.state_version, color, float(message["width"]), num_points)
+                # Pack every coordinate in one call instead of one struct.pack per point
+                body = body_struct.pack(*coords)
+                binary_message = header + body
+
+            # Keep only the binary frame, it is all a full-state send needs
+            self.drawing_state[stroke_id] = binary_message
+            self.total_points += num_points
             if client_ip:
-                message["client_ip"] = client_ip
+                self.drawing_owners[stroke_id] = client_ip
 
                 # Store drawing by IP with memory management
                 if client_ip not in self.drawings_by_ip:
-                    self.drawings_by_ip[client_ip] = []
+                    self.drawings_by_ip[client_ip] = collections.deque()
                     self.ip_drawing_counts[client_ip] = 0
 
-                self.drawings_by_ip[client_ip].append(message)
+                self.drawings_by_ip[client_ip].append(stroke_id)
                 self.ip_drawing_counts[client_ip] = len(self.drawings_by_ip[client_ip])
 
-            self.drawing_state.append(message)
             self.manage_drawing_state()  # Manage memory usage
-            self.last_update_time = time.time()
-            self.state_version += 1  # Increment version on state change
-            # Include version in the outgoing message
-            message["version"] = self.state_version
-            # Pack drawing message as binary:
-            points = message["points"]
-            header = struct.pack('!B I I f I', 1, self.state_version, int(message["color"].lstrip('#'), 16), float(message["width"]), len(points))
-            body = b''.join([struct.pack('!f f', p["x"], p["y"]) for p in points])
-            binary_message = header + body
 
         elif message.get("type") == "clear":
             self.drawing_state.clear()
+            self.drawing_owners.clear()
+            self.total_points = 0
             # Clear IP-based drawings too
             self.drawings_by_ip.clear()
+            self.ip_drawing_counts.clear()
             self.last_update_time = time.time()
             self.state_version += 1  # Increment version on state change
             # Include version in the outgoing message
             message["version"] = self.state_version
-            binary_message = struct.pack('!B I', 2, self.state_version)
+            binary_message = MESSAGE_HEADER.pack(2, self.state_version)
 
         elif message.get("type") == "undo" and client_ip:
             # Handle undo event for specific client IP
@@ -242,162 +614,174 @@ class ConnectionManager:
 
             if client_ip in self.drawings_by_ip and self.drawings_by_ip[client_ip]:
                 # Remove the latest drawing from this IP
-                removed_drawing = self.drawings_by_ip[client_ip].pop()
+                ip_strokes = self.drawings_by_ip[client_ip]
+                stroke_id = ip_strokes.pop()
+                self.ip_drawing_counts[client_ip] = len(ip_strokes)
+                if not ip_strokes:
+                    self.forget_ip(client_ip)
 
                 # Also remove it from global drawing state
-                if removed_drawing in self.drawing_state:
-                    self.drawing_state.remove(removed_drawing)
+                removed = self.drawing_state.pop(stroke_id, None)
+                if removed is not None:
+                    self.total_points -= stroke_point_count(removed)
+                self.drawing_owners.pop(stroke_id, None)
 
                 self.last_update_time = time.time()
                 self.state_version += 1  # Increment version on state change
 
                 # Include version in the outgoing message
                 message["version"] = self.state_version
-                binary_message = struct.pack('!B I', 3, self.state_version)
+                binary_message = MESSAGE_HEADER.pack(3, self.state_version)
 
                 # Force state update for all clients after undo
                 await self.broadcast_state_update()
 
-                logger.info(f"Undo operation from IP {client_ip}: removed 1 drawing. Remaining drawings for this IP: {len(self.drawings_by_ip[client_ip])}")
+                logger.info(f"Undo operation from IP {client_ip}: removed 1 drawing. Remaining drawings for this IP: {len(ip_strokes)}")
             else:
                 logger.warning(f"Undo operation from IP {client_ip}: No drawings to undo")
                 return  # No drawings to undo, don't broadcast
 
-        # Broadcast to all connections except the sender
-        failed_connections = set()
-        for client_type in self.active_connections:
-            for connection in self.active_connections[client_type]:
-                if connection != exclude:
-                    try:
-                        # Special case logging for undo
-                        if message.get("type") == "undo":
-                            logger.debug(f"Broadcasting undo to {client_type} client: {connection.client.host}:{connection.client.port}")
-
-                        if message.get("type") in ["draw", "clear", "undo"] and binary_message:
-                            await connection.send_bytes(binary_message)
-                            self.client_versions[connection] = self.state_version
-                        else:
-                            await connection.send_json(message)
-                    except Exception as e:
-                        logger.error(f"Failed to send to client: {e}")
-                        failed_connections.add((connection, client_type))
-
-        # Remove any connections that failed
-        for connection, client_type in failed_connections:
-            self.disconnect(connection, client_type)
-
-    async def check_connection(self, websocket: WebSocket) -> bool:
-        try:
-            await websocket.send_json({"type": "ping", "timestamp": time.time()})
-            return True
-        except:
-            return False
+        if binary_message:
+            self.event_log.append((self.state_version, binary_message))
+            # The sender already applied its own event, so don't replay it back to them
+            if exclude is not None and exclude.version == self.state_version - 1:
+                exclude.version = self.state_version
+
+        if msg_type == "draw":
+            # Nobody else to send it to, e.g. a single user drawing alone. The frame is in the
+            # state and the event log already for whoever connects next.
+            sender_connected = exclude is not None and self.is_connected(exclude)
+            if sum(self.connection_counts.values()) <= sender_connected:
+                return
+            # Coalesce draws arriving close together into one batch frame per client
+            self._pending_draws.append((binary_message, exclude))
+            if self._flush_handle is None:
+                self._flush_handle = self.event_loop().call_later(self.draw_batch_interval, self.flush_draws)
+            return
+
+        # Queue for all connections except the sender; the writer tasks do the actual
+        # sending so a single slow client doesn't hold up everyone else
+        if message.get("type") == "undo":
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Broadcasting undo to {sum(self.connection_counts.values())} clients")
+
+        payload = binary_message if binary_message else encode_message(message)
+        for slot in self.connected_slots():
+            if slot is not exclude and self.queue_message(slot, payload) and binary_message:
+                slot.version = self.state_version
+
+    def flush_draws(self):
+        """Send the coalesced draw frames to every client as one batch frame.
+
+        Clients don't get their own strokes back, nor the draws a catch-up or full state send
+        already gave them.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending_draws:
+            return
+        pending, self._pending_draws = self._pending_draws, []
+        covered, self._skip_flush = self._skip_flush, {}
+
+        senders = {sender for _, sender in pending}
+        full_batch = None
+        for slot in self.connected_slots():
+            done = covered.get(slot, 0)
+            if done or slot in senders:
+                frames = [frame for frame, sender in pending[done:] if sender is not slot]
+                if not frames:
+                    continue
+                payload = pack_draw_batch(frames, self.state_version)
+            else:
+                if full_batch is None:
+                    full_batch = pack_draw_batch([frame for frame, _ in pending], self.state_version)
+                payload = full_batch
+            if self.queue_message(slot, payload):
+                slot.version = self.state_version
+
+    def check_connection(self, slot: ClientSlot) -> bool:
+        return self.queue_message(slot, PING_FRAME.pack(10, time.time() * 1000))
 
     async def remove_dead_connections(self):
-        current_time = time.time()
-        failed_connections = set()
-
-        for client_type in list(self.active_connections.keys()):
-            for connection in list(self.active_connections[client_type]):
-                # Check if connection hasn't responded in 30 seconds
-                if current_time - self.last_ping_times.get(connection, 0) > 30:
-                    try:
-                        if not await self.check_connection(connection):
-                            failed_connections.add((connection, client_type))
-                    except Exception:
-                        failed_connections.add((connection, client_type))
-
-        for connection, client_type in failed_connections:
-            self.disconnect(connection, client_type)
+        current_time = self.event_loop().time()
+        heap = self._ping_heap
+        if not heap or current_time - heap[0][0] <= 30:
+            return  # Nobody has been idle long enough, the common case
+
+        # Only connections that haven't responded in 30 seconds are popped off the heap.
+        # A ping that can't be queued disconnects the client inside queue_message.
+        idle_entries = []
+        while heap and current_time - heap[0][0] > 30:
+            entry = heapq.heappop(heap)
+            last_ping, _, slot = entry
+            if slot.last_ping != last_ping or not self.is_connected(slot):
+                continue  # Superseded by newer activity, or already disconnected
+            if self.check_connection(slot):
+                idle_entries.append(entry)
+
+        # Still idle, check again on the next pass
+        for entry in idle_entries:
+            heapq.heappush(heap, entry)
 
     async def periodic_state_check(self):
-        while True:
+        """Run all periodic connection work from one loop: liveness checks and state syncs
+        every second, and a heartbeat every 10 seconds."""
+        for tick in itertools.count():
             try:
                 await self.remove_dead_connections()  # Check for dead connections
                 await self.sync_client_states()  # Sync client states
-
-                await asyncio.sleep(1)  # Reduced interval for quicker sync
+                if tick % 10 == 0:
+                    self.send_heartbeat()
             except Exception as e:
                 logger.error(f"Error in periodic state check: {e}")
-                await asyncio.sleep(1)
+            await asyncio.sleep(1)  # Reduced interval for quicker sync
 
     async def sync_client_states(self):
         """Ensure all clients have the current state version using differential updates when possible"""
-        for client_type in self.active_connections:
-            for connection in list(self.active_connections[client_type]):
-                # Check if client's version does not match the server's
-                if connection in self.client_versions and self.client_versions[connection] != self.state_version:
-                    try:
-                        client_last_version = self.client_versions[connection]
-                        # Get missing actions since client's last version
-                        missing_actions = [action for action in self.drawing_state
-                                         if action.get("version", 0) > client_last_version]
-
-                        if len(missing_actions) < 10:  # Small diff, send just the missing actions
-                            await connection.send_json({
-                                "type": "updates",
-                                "actions": missing_actions,
-                                "version": self.state_version
-                            })
-                        else:  # Too many differences, send full state
-                            await connection.send_json({
-                                "type": "state",
-                                "state": self.drawing_state,
-                                "version": self.state_version
-                            })
-
-                        self.client_versions[connection] = self.state_version
-                    except Exception as e:
-                        logger.error(f"Failed to sync state with client: {e}")
-
-    async def start_heartbeat(self):
-        """Start sending regular heartbeats to all clients"""
+        # Clients only fall behind when the state changes, so there is nothing to do while idle
+        current_state = (self.state_version, self.snapshot_epoch)
+        if self._synced_state == current_state:
+            return
+        self._synced_state = current_state
+
+        for slot in self.connected_slots():
+            # Check if client's version or snapshot epoch does not match the server's
+            if slot.version != self.state_version or slot.epoch != self.snapshot_epoch:
+                self.catch_up_client(slot, slot.version)
+
+    def send_heartbeat(self):
+        """Send a heartbeat to all clients"""
+        # Same 9-byte layout as a ping, with type 12
+        payload = PING_FRAME.pack(12, time.time() * 1000)
+        for slot in self.connected_slots():
+            self.queue_message(slot, payload)
+
+    async def sample_system_usage(self):
+        """Refresh the CPU and memory readings every 2 seconds so /health never blocks on them"""
+        import psutil
+
         while True:
             try:
-                current_time = time.time()
-                for client_type in self.active_connections:
-                    for connection in list(self.active_connections[client_type]):
-                        try:
-                            await connection.send_json({
-                                "type": "heartbeat",
-                                "timestamp": current_time
-                            })
-                        except:
-                            # Will be handled by remove_dead_connections
-                            pass
-                await asyncio.sleep(10)  # Send heartbeat every 10 seconds
+                # Non-blocking: measures CPU use since the previous call
+                self.cpu_percent = psutil.cpu_percent(interval=None)
+                self.memory_percent = psutil.virtual_memory().percent
             except Exception as e:
-                logger.error(f"Error in heartbeat: {e}")
-                await asyncio.sleep(10)
+                logger.error(f"Error sampling system usage: {e}")
+            await asyncio.sleep(2)
 
     async def broadcast_state_update(self):
         """Send current state to all clients"""
-        state_message = {
-            "type": "state",
-            "state": self.drawing_state,
-            "version": self.state_version
-        }
-
-        failed_connections = set()
-        for client_type in self.active_connections:
-            for connection in self.active_connections[client_type]:
-                try:
-                    await connection.send_json(state_message)
-                    self.client_versions[connection] = self.state_version
-                except Exception as e:
-                    logger.error(f"Failed to send state update to client: {e}")
-                    failed_connections.add((connection, client_type))
-
-        # Remove any connections that failed
-        for connection, client_type in failed_connections:
-            self.disconnect(connection, client_type)
+        for slot in self.connected_slots():
+            self.send_state(slot)
 
 manager = ConnectionManager()
 
 @app.on_event("startup")
 async def startup_event():
+    manager.loop = asyncio.get_running_loop()
     asyncio.create_task(manager.periodic_state_check())
-    asyncio.create_task(manager.start_heartbeat())
+    asyncio.create_task(manager.sample_system_usage())
 
 @app.get("/test")
 async def test_endpoint():
@@ -406,32 +790,29 @@ async def test_endpoint():
 @app.get("/health")
 async def health_check():
     import psutil
-    import os
 
     # System metrics
     disk = psutil.disk_usage(os.path.abspath(os.sep))
 
     # Connection metrics
-    draw_connections = len(manager.active_connections.get('draw', set()))
-    display_connections = len(manager.active_connections.get('display', set()))
+    draw_connections = manager.connection_counts['draw']
+    display_connections = manager.connection_counts['display']
     total_connections = draw_connections + display_connections
 
     # Drawing metrics
     total_drawings = len(manager.drawing_state)
-    total_points = sum(len(drawing.get("points", [])) for drawing in manager.drawing_state if drawing.get("type") == "draw")
-    drawings_per_client = {}
-    for ip, drawings in manager.drawings_by_ip.items():
-        drawings_per_client[ip] = len(drawings)
+    total_points = manager.total_points
+    drawings_per_client = dict(manager.ip_drawing_counts)  # Kept up to date on draw, undo and prune
 
     # Version sync metrics
-    outdated_clients = sum(1 for client_version in manager.client_versions.values()
-                          if client_version < manager.state_version)
+    outdated_clients = sum(1 for slot in manager.connected_slots()
+                          if slot.version < manager.state_version)
 
     return {
         "status": "healthy",
         "system": {
-            "memory_usage_percent": psutil.virtual_memory().percent,
-            "cpu_usage_percent": psutil.cpu_percent(interval=0.1),
+            "memory_usage_percent": manager.memory_percent,
+            "cpu_usage_percent": manager.cpu_percent,
             "disk_usage_percent": disk.percent,
             "disk_free_gb": round(disk.free / (1024**3), 2)
         },
@@ -456,115 +837,115 @@ async def health_check():
         "uptime_seconds": time.time() - START_TIME
     }
 
+def handle_ping(slot: ClientSlot, msg: dict):
+    manager.queue_message(slot, encode_message({
+        "type": "pong",
+        "timestamp": msg.get("timestamp", time.time())
+    }))
+
+def handle_pong(slot: ClientSlot, msg: dict):
+    pass  # Just update the ping time, which the receive loop already did
+
+def handle_state_request(slot: ClientSlot, msg: dict):
+    # Handle specific request for complete state
+    client_version = msg.get("current_version", 0)
+    if client_version < manager.state_version:
+        manager.send_state(slot)
+
+def handle_state_version_check(slot: ClientSlot, msg: dict):
+    # Check if client needs a state update based on version
+    client_version = msg.get("current_version", 0)
+    if not isinstance(client_version, int):
+        client_version = 0  # Malformed, resync from scratch
+    if client_version < manager.state_version:
+        # Use differential updates when appropriate
+        manager.catch_up_client(slot, client_version)
+
+# Message type -> handler for messages that are answered rather than relayed
+CONTROL_HANDLERS = {
+    "ping": handle_ping,
+    "pong": handle_pong,
+    "state_request": handle_state_request,
+    "state_version_check": handle_state_version_check,
+}
+
 @app.websocket("/ws/{client_type}")
 async def websocket_endpoint(websocket: WebSocket, client_type: str):
     logger.info(f"New WebSocket connection request - Client Type: {client_type}")
 
-    if client_type not in ['draw', 'display']:
+    if client_type not in CLIENT_TYPES:
         logger.warning(f"Invalid client type attempted to connect: {client_type}")
         await websocket.close(code=1003)  # Unsupported data
         return
 
-    await manager.connect(websocket, client_type)
+    slot = await manager.connect(websocket, client_type)
 
     try:
         # If this is a new client, broadcast new-client event
         if client_type == 'draw':
             logger.info(f"New drawing client connected - Broadcasting new-client event")
-            await manager.broadcast({"type": "new-client"}, exclude=websocket)
+            await manager.broadcast({"type": "new-client"}, exclude=slot)
 
+        # Read ASGI messages directly; websocket.receive() only adds state checks on top
+        receive = websocket._receive
+        client_ip = slot.ip
         while True:
-            data = await websocket.receive()
-            client_ip = websocket.client.host
+            data = await receive()
+            if data["type"] != "websocket.receive":
+                if data["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(data.get("code", 1000), data.get("reason"))
+                continue
+            raw = data.get("bytes")
 
-            if "text" in data:
-                try:
-                    msg = json.loads(data["text"])
-                except json.JSONDecodeError:
-                    logger.error(f"Invalid JSON received: {data['text'][:100]}")
-                    continue
-            elif "bytes" in data:
+            # Binary ping/pong only needs the activity update, and a ping is echoed back as is
+            if raw is not None and len(raw) == PING_FRAME.size and raw[0] in (10, 11):
+                manager.record_activity(slot, manager.event_loop().time())
+                if raw[0] == 10:
+                    manager.queue_message(slot, b'\x0b' + raw[1:])
+                continue
+
+            if raw is not None:  # Binary draw frames are the common case
                 try:
-                    msg = decode_draw_message(data["bytes"])
+                    msg = decode_draw_message(raw)
                 except Exception as e:
                     logger.error(f"Error decoding binary message: {e}")
                     continue
+            elif data.get("text") is not None:
+                try:
+                    msg = orjson.loads(data["text"])
+                except orjson.JSONDecodeError:
+                    logger.error(f"Invalid JSON received: {data['text'][:100]}")
+                    continue
             else:
                 continue
 
             # Update last ping time when we receive any message
-            manager.last_ping_times[websocket] = time.time()
-
-            # Handle ping/pong messages specially
-            if msg.get("type") == "ping":
-                await websocket.send_json({
-                    "type": "pong",
-                    "timestamp": msg.get("timestamp", time.time())
-                })
-                continue
-            elif msg.get("type") == "pong":
-                # Just update the ping time, which was already done above
-                continue
-            elif msg.get("type") == "state_request":
-                # Handle specific request for complete state
-                client_version = msg.get("current_version", 0)
-                if client_version < manager.state_version:
-                    # Use differential updates when appropriate
-                    missing_actions = [action for action in manager.drawing_state
-                                     if action.get("version", 0) > client_version]
-
-                    if len(missing_actions) < 10:  # Small diff, send just the missing actions
-                        await websocket.send_json({
-                            "type": "updates",
-                            "actions": missing_actions,
-                            "version": manager.state_version
-                        })
-                    else:  # Too many differences, send full state
-                        await websocket.send_json({
-                            "type": "state",
-                            "state": manager.drawing_state,
-                            "version": manager.state_version
-                        })
-                    manager.client_versions[websocket] = manager.state_version
-                continue
-            elif msg.get("type") == "state_version_check":
-                # Check if client needs a state update based on version
-                client_version = msg.get("current_version", 0)
-                if client_version < manager.state_version:
-                    # Use differential updates when appropriate
-                    missing_actions = [action for action in manager.drawing_state
-                                     if action.get("version", 0) > client_version]
-
-                    if len(missing_actions) < 10:  # Small diff, send just the missing actions
-                        await websocket.send_json({
-                            "type": "updates",
-                            "actions": missing_actions,
-                            "version": manager.state_version
-                        })
-                    else:  # Too many differences, send full state
-                        await websocket.send_json({
-                            "type": "state",
-                            "state": manager.drawing_state,
-                            "version": manager.state_version
-                        })
-                    manager.client_versions[websocket] = manager.state_version
+            manager.record_activity(slot, manager.event_loop().time())
+
+            # Control messages are answered directly rather than relayed
+            handler = CONTROL_HANDLERS.get(msg.get("type"))
+            if handler is not None:
+                handler(slot, msg)
                 continue
 
             # Relay other messages to all clients
             # For drawing data and undo, include the client IP address
             if msg.get("type") in ["draw", "undo"]:
-                logger.info(f"Broadcasting {msg.get('type')} message from {client_ip}")
-                await manager.broadcast(msg, exclude=websocket, client_ip=client_ip)
+                logger.debug("Broadcasting %s message from %s", msg.get('type'), client_ip)
+                await manager.broadcast(msg, exclude=slot, client_ip=client_ip, raw=raw)
             else:
-                await manager.broadcast(msg, exclude=websocket)
+                await manager.broadcast(msg, exclude=slot)
 
     except WebSocketDisconnect:
         logger.info(f"WebSocket disconnected - Client Type: {client_type} | Address: {websocket.client.host}:{websocket.client.port}")
-        manager.disconnect(websocket, client_type)
+        manager.disconnect(slot)
     except Exception as e:
         logger.error(f"Error handling WebSocket: {e}")
-        manager.disconnect(websocket, client_type)
+        manager.disconnect(slot)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8080)
\ No newline at end of file
+    # uvloop and httptools speed up socket I/O and handshakes. Keep a single worker: connection
+    # and drawing state live in this process, so extra workers would each have their own canvas.
+    uvicorn.run(app, host="0.0.0.0", port=8080, loop="uvloop", http="httptools", ws="websockets",
+                ws_max_size=MAX_MESSAGE_SIZE, workers=1)
\ No newline at end of file
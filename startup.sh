@@ -29,4 +29,4 @@ else
 fi
 
 echo "Starting server..."
-uvicorn main:app --host 0.0.0.0 --port 8080
+uvicorn main:app --host 0.0.0.0 --port 8080 --loop uvloop --http httptools --ws-max-size 1048576